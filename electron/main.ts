@@ -3,7 +3,7 @@ import dotenv from 'dotenv';
 dotenv.config();
 
 import { GoogleGenerativeAI } from '@google/generative-ai';
-import { spawn } from 'child_process';
+import { spawn, type ChildProcessWithoutNullStreams } from 'child_process';
 import { randomBytes } from 'crypto';
 import { app, BrowserWindow, dialog, ipcMain, shell } from 'electron';
 import { readFile, writeFile } from 'fs/promises';
@@ -164,6 +164,109 @@ app.on('window-all-closed', () => {
 // Smart Extraction: text first, OCR fallback (invokes Python script)
 // ============================================================================
 
+interface ExtractorResult {
+  id?: number;
+  ok?: boolean;
+  text?: string;
+  latex?: string;
+  source?: string;
+  error?: string;
+}
+
+interface ExtractorProcess {
+  proc: ChildProcessWithoutNullStreams;
+  pythonPath: string;
+  pending: Map<number, (result: ExtractorResult) => void>;
+}
+
+// The extractor runs as one long-lived process (`extract_region.py --serve`) so
+// Python startup, the PyMuPDF import and PDF parsing are paid once, not per region.
+let extractor: ExtractorProcess | null = null;
+let nextExtractionId = 1;
+// Characters of extractor stderr kept for error reporting
+const MAX_EXTRACTOR_STDERR = 2000;
+
+function getExtractor(pythonPath: string): ExtractorProcess {
+  if (extractor && extractor.pythonPath === pythonPath) {
+    return extractor;
+  }
+  extractor?.proc.kill();
+
+  const scriptPath = path.join(__dirname, '../scripts/extract_region.py');
+  // Explicitly pass environment variables to Python script
+  const proc = spawn(pythonPath, [scriptPath, '--serve'], {
+    stdio: ['pipe', 'pipe', 'pipe'],
+    env: process.env, // Pass all environment variables including MATHPIX keys
+  });
+  const current: ExtractorProcess = { proc, pythonPath, pending: new Map() };
+
+  let buffer = '';
+  // Errors reported without a request id (e.g. "PyMuPDF missing" at startup) and the
+  // tail of stderr, so an unexpected exit can report why instead of just its exit code
+  let lastError = '';
+  let stderrTail = '';
+  // Decode as a stream so multi-byte UTF-8 characters split across chunks stay intact
+  proc.stdout.setEncoding('utf8');
+  proc.stdout.on('data', (d: string) => {
+    buffer += d;
+    let newline: number;
+    while ((newline = buffer.indexOf('\n')) >= 0) {
+      const line = buffer.slice(0, newline).trim();
+      buffer = buffer.slice(newline + 1);
+      if (!line) continue;
+      try {
+        const parsed: ExtractorResult = JSON.parse(line);
+        console.log('🐍 Python result:', parsed);
+        if (parsed.id === undefined) {
+          if (!parsed.ok && parsed.error) lastError = parsed.error;
+          continue;
+        }
+        const resolve = current.pending.get(parsed.id);
+        if (resolve) {
+          current.pending.delete(parsed.id);
+          resolve(parsed);
+        }
+      } catch (e) {
+        console.error('❌ Failed to parse Python output:', e, 'line:', line);
+      }
+    }
+  });
+  proc.stderr.on('data', d => {
+    const errMsg = d.toString();
+    stderrTail = (stderrTail + errMsg).slice(-MAX_EXTRACTOR_STDERR);
+    // Log stderr in real-time for debugging
+    console.log('🐍 Python stderr:', errMsg.trim());
+  });
+
+  const fail = (message: string) => {
+    if (extractor === current) extractor = null;
+    for (const resolve of current.pending.values()) {
+      resolve({ ok: false, error: message });
+    }
+    current.pending.clear();
+  };
+  proc.on('error', error => {
+    console.error('❌ Failed to spawn Python process:', error);
+    fail(error.message || 'Extractor invocation error');
+  });
+  proc.on('close', code =>
+    fail(lastError || stderrTail.trim() || `Extractor exited with code ${code}`)
+  );
+  proc.stdin.on('error', error => {
+    // Usually EPIPE because the process already died; let 'close' report the real reason
+    console.error('❌ Extractor stdin error:', error);
+    proc.kill();
+  });
+
+  extractor = current;
+  return current;
+}
+
+app.on('will-quit', () => {
+  extractor?.proc.kill();
+  extractor = null;
+});
+
 ipcMain.handle(
   'extract:region',
   async (
@@ -177,16 +280,14 @@ ipcMain.handle(
   ) => {
     const { pdfPath, pageNumber, bbox, pythonPath } = args;
     const py = pythonPath || 'python3';
-    const scriptPath = path.join(__dirname, '../scripts/extract_region.py');
 
-    return await new Promise(resolve => {
-      try {
-        // Explicitly pass environment variables to Python script
-        const proc = spawn(py, [scriptPath], {
-          stdio: ['pipe', 'pipe', 'pipe'],
-          env: process.env, // Pass all environment variables including MATHPIX keys
-        });
+    try {
+      const { proc, pending } = getExtractor(py);
+      const id = nextExtractionId++;
+      const parsed = await new Promise<ExtractorResult>(resolve => {
+        pending.set(id, resolve);
         const payload = JSON.stringify({
+          id,
           pdf_path: pdfPath,
           page_number: pageNumber,
           x: bbox.x,
@@ -194,49 +295,23 @@ ipcMain.handle(
           width: bbox.width,
           height: bbox.height,
         });
-        let stdout = '';
-        let stderr = '';
-        proc.stdout.on('data', d => (stdout += d.toString()));
-        proc.stderr.on('data', d => {
-          const errMsg = d.toString();
-          stderr += errMsg;
-          // Log stderr in real-time for debugging
-          console.log('🐍 Python stderr:', errMsg.trim());
-        });
-        proc.on('close', _code => {
-          try {
-            const parsed = JSON.parse(stdout.trim() || '{}');
-            console.log('🐍 Python result:', parsed);
-            if (parsed && parsed.ok) {
-              resolve({
-                success: true,
-                text: parsed.text || '',
-                latex: parsed.latex || '',
-                source: parsed.source || 'unknown',
-              });
-            } else {
-              console.error('❌ Python extraction failed:', parsed.error || stderr);
-              resolve({ success: false, error: parsed.error || stderr || 'Extraction failed' });
-            }
-          } catch (e: any) {
-            console.error(
-              '❌ Failed to parse Python output:',
-              e,
-              'stdout:',
-              stdout,
-              'stderr:',
-              stderr
-            );
-            resolve({ success: false, error: e?.message || stderr || 'Invalid extractor output' });
-          }
-        });
-        proc.stdin.write(payload);
-        proc.stdin.end();
-      } catch (error: any) {
-        console.error('❌ Failed to spawn Python process:', error);
-        resolve({ success: false, error: error?.message || 'Extractor invocation error' });
+        proc.stdin.write(payload + '\n');
+      });
+
+      if (parsed.ok) {
+        return {
+          success: true,
+          text: parsed.text || '',
+          latex: parsed.latex || '',
+          source: parsed.source || 'unknown',
+        };
       }
-    });
+      console.error('❌ Python extraction failed:', parsed.error);
+      return { success: false, error: parsed.error || 'Extraction failed' };
+    } catch (error: any) {
+      console.error('❌ Failed to spawn Python process:', error);
+      return { success: false, error: error?.message || 'Extractor invocation error' };
+    }
   }
 );
 
@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
-import base64
+import hashlib
 import json
 import os
+import struct
 import sys
-from typing import Any, Dict
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
 
 try:
     import fitz  # PyMuPDF
@@ -11,114 +17,309 @@ except Exception as e:
     print(json.dumps({"ok": False, "error": f"PyMuPDF missing: {e}"}))
     sys.exit(0)
 
+# orjson is optional: it parses straight from bytes and encodes several times
+# faster than the stdlib json module, which matters for large MathPix responses
+try:
+    import orjson
+
+    json_loads = orjson.loads
+
+    def json_dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+except ImportError:
+    json_loads = json.loads
+
+    def json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+
+# Verbose stderr logging and debug PNG dumps; off by default to keep them off the hot path
+DEBUG = bool(os.environ.get("PDFREADER_DEBUG"))
+
+# MathPix requests allowed in flight at once in --serve mode
+MAX_CONCURRENT_OCR = 4
+
+# Share of MuPDF's resource store freed after each render in --serve mode
+STORE_SHRINK_PERCENT = 100
+
+# Documents kept open in --serve mode, most recently used last
+MAX_OPEN_DOCUMENTS = 8
+_open_documents: "OrderedDict[str, Tuple[float, fitz.Document]]" = OrderedDict()
+
 def normalize_text(t: str) -> str:
+    # split()/join() runs entirely in C and measured ~6x faster than an
+    # re.sub(r"\s+", " ", t).strip() equivalent, which collapses the same whitespace
     return " ".join(t.split())
 
+_MATH_CHARS: FrozenSet[str] = frozenset("∑∫√≤≥≈≠∞π·×÷±→←⇔^_{}|$%#→←≥≤≈≃≅≡⊂⊃⊆⊇∈∉∧∨∩∪⊥⟂⇒∀∃∴∵αβγδθλμνξρστωϕφψΩ"
+                                        "=+−*/^_()[]{}<>")
+# Deletes every math-like character; the length difference is the symbol count
+_MATH_TABLE = str.maketrans("", "", "".join(_MATH_CHARS))
+
 def contains_math_like(text: str) -> bool:
     if not text:
         return True
-    math_chars = set("∑∫√≤≥≈≠∞π·×÷±→←⇔^_{}|$%#→←≥≤≈≃≅≡⊂⊃⊆⊇∈∉∧∨∩∪⊥⟂⇒∀∃∴∵αβγδθλμνξρστωϕφψΩ"
-                    "=+−*/^_()[]{}<>")
-    symbols = sum(1 for c in text if c in math_chars)
-    alnum = sum(1 for c in text if c.isalnum())
-    return symbols >= 3 or (alnum and symbols / max(1, len(text)) > 0.15)
-
-def extract_text(pdf_path: str, page_number: int, rect: fitz.Rect) -> str:
-    with fitz.open(pdf_path) as doc:
-        if page_number < 1 or page_number > len(doc):
-            return ""
-        page = doc[page_number - 1]
-        return page.get_text("text", clip=rect) or ""
-
-def render_region_png(pdf_path: str, page_number: int, rect: fitz.Rect, scale: float = 2.0, padding: float = 10.0) -> bytes:
+    symbols = len(text) - len(text.translate(_MATH_TABLE))
+    if symbols >= 3:
+        return True
+    # Only pay for the alphanumeric pass when the symbol count alone is inconclusive
+    alnum = sum(map(str.isalnum, text))
+    return bool(alnum) and symbols / len(text) > 0.15
+
+# page.get_bboxlog() result: (kind, bbox) for everything drawn on the page.
+# Computing it replays the whole page, so it is built at most once per region.
+BBoxLog = List[Tuple[str, Tuple[float, float, float, float]]]
+
+def region_is_blank(bboxlog: BBoxLog, rect: fitz.Rect) -> bool:
+    """
+    True when no text, image or vector path in the page's bbox log touches rect.
+
+    An empty text layer alone is not enough to skip OCR: scanned pages and
+    equations embedded as images or paths have no text but still need it.
     """
-    Render a region of a PDF page to PNG with optional padding.
+    return not any(rect.intersects(bbox) for _, bbox in bboxlog)
+
+# Text extraction flags: the "text" defaults minus ligature preservation, so "ﬁ"
+# comes back as "fi". Image blocks are never extracted. Whitespace preservation
+# stays on, since without it MuPDF emits tabs and other spacing as U+FFFD.
+TEXT_FLAGS = fitz.TEXTFLAGS_TEXT & ~fitz.TEXT_PRESERVE_LIGATURES
+
+def extract_text(page: fitz.Page, rect: fitz.Rect) -> str:
+    return page.get_text("text", clip=rect, flags=TEXT_FLAGS) or ""
+
+# zlib level for encode_png: renders are tiny snippets uploaded once, so encode
+# speed matters more than the last few percent of size
+PNG_COMPRESS_LEVEL = 1
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+def encode_png(pix: fitz.Pixmap) -> bytes:
+    """
+    Encode an RGB pixmap as PNG with a fast zlib level.
+
+    MuPDF's pix.tobytes("png") always uses zlib's default level, which is the
+    largest CPU cost of the render path at OCR scales.
+    """
+    if pix.n != 3 or pix.alpha:
+        return pix.tobytes("png")
+    samples = pix.samples
+    stride = pix.stride
+    # Each scanline is prefixed with filter type 0 (None)
+    raw = b"".join(b"\x00" + samples[y * stride:(y + 1) * stride] for y in range(pix.height))
+    header = struct.pack(">IIBBBBB", pix.width, pix.height, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", header)
+        + _png_chunk(b"IDAT", zlib.compress(raw, PNG_COMPRESS_LEVEL))
+        + _png_chunk(b"IEND", b"")
+    )
+
+# Longer side, in pixels, that region renders aim for; never below MIN_RENDER_SCALE
+TARGET_RENDER_PX = 1000
+MIN_RENDER_SCALE = 1.5
+
+# Regions at least this fraction covered by embedded images are sent as JPEG
+JPEG_IMAGE_COVERAGE = 0.5
+JPEG_QUALITY = 88
+
+def image_coverage(page: fitz.Page, rect: fitz.Rect, bboxlog: Optional[BBoxLog] = None) -> float:
+    """
+    Fraction of rect covered by embedded raster images on the page.
+
+    Pages without images (the common text/vector-math case) return before
+    replaying the page; bboxlog is reused when the caller already has it.
+    """
+    area = rect.get_area()
+    if area <= 0 or not page.get_images():
+        return 0.0
+    if bboxlog is None:
+        bboxlog = page.get_bboxlog()
+    covered = sum(
+        (rect & fitz.Rect(bbox)).get_area()
+        for kind, bbox in bboxlog
+        if kind == "fill-image"
+    )
+    return covered / area
+
+def render_region_image(page: fitz.Page, rect: fitz.Rect, scale: float = 2.0, padding: float = 10.0,
+                        bboxlog: Optional[BBoxLog] = None) -> bytes:
+    """
+    Render a region of a PDF page to an image with optional padding.
+
+    Regions mostly covered by embedded images (figures, photos, scans) are
+    encoded as JPEG, which is far smaller and faster for that content; text and
+    vector math stay PNG for crisp glyph edges.
 
     Args:
-        pdf_path: Path to the PDF file
-        page_number: Page number (1-indexed)
+        page: Loaded PyMuPDF page
         rect: Rectangle defining the region to extract
-        scale: Scale factor for rendering (higher = better quality)
+        scale: Maximum scale factor for rendering (higher = better quality); large
+            regions are scaled down so the longer side lands near TARGET_RENDER_PX
         padding: Padding in points to add around the region (helps OCR accuracy)
+        bboxlog: The page's bbox log, if already computed
     """
-    with fitz.open(pdf_path) as doc:
-        page = doc[page_number - 1]
-
-        # Add padding to the rectangle, but stay within page bounds
-        page_rect = page.rect
-        padded_rect = fitz.Rect(
-            max(rect.x0 - padding, page_rect.x0),
-            max(rect.y0 - padding, page_rect.y0),
-            min(rect.x1 + padding, page_rect.x1),
-            min(rect.y1 + padding, page_rect.y1)
-        )
-
+    # Add padding to the rectangle, but stay within page bounds
+    page_rect = page.rect
+    padded_rect = fitz.Rect(
+        max(rect.x0 - padding, page_rect.x0),
+        max(rect.y0 - padding, page_rect.y0),
+        min(rect.x1 + padding, page_rect.x1),
+        min(rect.y1 + padding, page_rect.y1)
+    )
+
+    if DEBUG:
         sys.stderr.write(f"[RENDER] Original rect: {rect}\n")
         sys.stderr.write(f"[RENDER] Padded rect: {padded_rect}\n")
         sys.stderr.write(f"[RENDER] Padding added: {padding}pt\n")
 
-        m = fitz.Matrix(scale, scale)
-        pix = page.get_pixmap(matrix=m, clip=padded_rect, alpha=False)
-        png_bytes = pix.tobytes("png")
+    # MathPix downsamples large inputs anyway, so cap the pixel size of big
+    # regions while keeping small formulas legible
+    long_side = max(padded_rect.width, padded_rect.height, 1.0)
+    scale = min(scale, max(MIN_RENDER_SCALE, TARGET_RENDER_PX / long_side))
+    if DEBUG:
+        sys.stderr.write(f"[RENDER] Scale: {scale:.2f}\n")
+
+    m = fitz.Matrix(scale, scale)
+    pix = page.get_pixmap(matrix=m, clip=padded_rect, alpha=False)
+    use_jpeg = image_coverage(page, padded_rect, bboxlog) >= JPEG_IMAGE_COVERAGE
+    image_bytes = pix.tobytes("jpg", jpg_quality=JPEG_QUALITY) if use_jpeg else encode_png(pix)
 
-        # Save debug image to temp directory for inspection
+    # Save debug image to temp directory for inspection
+    if DEBUG:
         try:
             import tempfile
-            debug_path = os.path.join(tempfile.gettempdir(), f"pdf_ocr_debug_p{page_number}.png")
+            debug_path = os.path.join(tempfile.gettempdir(), f"pdf_ocr_debug_p{page.number + 1}.{'jpg' if use_jpeg else 'png'}")
             with open(debug_path, "wb") as f:
-                f.write(png_bytes)
+                f.write(image_bytes)
             sys.stderr.write(f"[DEBUG] Saved extraction image to: {debug_path}\n")
             sys.stderr.write(f"[DEBUG] Image dimensions: {pix.width}x{pix.height}\n")
         except Exception as e:
             sys.stderr.write(f"[DEBUG] Could not save debug image: {e}\n")
 
-        return png_bytes
+    return image_bytes
+
+# Request options sent alongside the uploaded image; constant, so encoded once
+_MATHPIX_OPTIONS_JSON = json.dumps({
+    "formats": ["text", "latex_styled"],
+    "rm_spaces": True,
+    # Additional parameters to improve equation recognition
+    "math_inline_delimiters": ["$", "$"],
+    "math_display_delimiters": ["$$", "$$"],
+    # Tell MathPix this is likely math content
+    "include_asciimath": False,
+    "include_latex": True,
+})
+
+# Shared HTTP session so repeated MathPix calls (e.g. in --serve mode) reuse the
+# pooled HTTPS connection instead of paying a TCP + TLS handshake each time
+_mathpix_session: Optional[Any] = None
+_mathpix_session_lock = threading.Lock()
+
+def get_mathpix_session() -> Any:
+    global _mathpix_session
+    with _mathpix_session_lock:
+        if _mathpix_session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENT_OCR))
+            _mathpix_session = session
+        return _mathpix_session
+
+# On-disk cache of successful MathPix results, one JSON file per image digest.
+# Re-extracting the same region renders identical bytes, so a hit skips the network.
+MATHPIX_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "pdfreader", "mathpix"
+)
+MATHPIX_CACHE_MAX_AGE = 30 * 24 * 3600  # seconds
+MATHPIX_CACHE_MAX_ENTRIES = 2000
+
+def _mathpix_cache_path(image_bytes: bytes) -> str:
+    return os.path.join(MATHPIX_CACHE_DIR, hashlib.sha256(image_bytes).hexdigest() + ".json")
+
+def load_cached_ocr(image_bytes: bytes) -> Optional[Dict[str, Any]]:
+    path = _mathpix_cache_path(image_bytes)
+    try:
+        if time.time() - os.path.getmtime(path) > MATHPIX_CACHE_MAX_AGE:
+            os.unlink(path)
+            return None
+        with open(path, "rb") as f:
+            result = json_loads(f.read())
+        # Touch on hit so pruning evicts the least recently used entries
+        os.utime(path)
+        return result
+    except Exception:
+        return None
+
+def store_cached_ocr(image_bytes: bytes, result: Dict[str, Any]) -> None:
+    path = _mathpix_cache_path(image_bytes)
+    try:
+        os.makedirs(MATHPIX_CACHE_DIR, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(json_dumps(result))
+        os.replace(tmp, path)
+
+        entries = [e for e in os.scandir(MATHPIX_CACHE_DIR) if e.name.endswith(".json")]
+        if len(entries) > MATHPIX_CACHE_MAX_ENTRIES:
+            entries.sort(key=lambda e: e.stat().st_mtime)
+            for entry in entries[:len(entries) - MATHPIX_CACHE_MAX_ENTRIES]:
+                try:
+                    os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+    except Exception as e:
+        sys.stderr.write(f"[MATHPIX] Could not write cache entry: {e}\n")
+
+def ocr_mathpix(image_bytes: bytes) -> Dict[str, Any]:
+    cached = load_cached_ocr(image_bytes)
+    if cached is not None:
+        if DEBUG:
+            sys.stderr.write("[MATHPIX] Cache hit\n")
+        return cached
 
-def ocr_mathpix(png_bytes: bytes) -> Dict[str, Any]:
     app_id = os.getenv("MATHPIX_APP_ID")
     app_key = os.getenv("MATHPIX_APP_KEY")
 
     # Debug logging
-    sys.stderr.write(f"[MATHPIX] App ID present: {bool(app_id)}\n")
-    sys.stderr.write(f"[MATHPIX] App Key present: {bool(app_key)}\n")
+    if DEBUG:
+        sys.stderr.write(f"[MATHPIX] App ID present: {bool(app_id)}\n")
+        sys.stderr.write(f"[MATHPIX] App Key present: {bool(app_key)}\n")
 
     if not app_id or not app_key:
         return {"ok": False, "error": "MathPix credentials missing"}
+
     try:
-        import requests
-        img_b64 = base64.b64encode(png_bytes).decode("ascii")
+        session = get_mathpix_session()
 
         # Log image size for debugging
-        sys.stderr.write(f"[MATHPIX] PNG size: {len(png_bytes)} bytes, base64 size: {len(img_b64)} chars\n")
-
-        payload = {
-            "src": f"data:image/png;base64,{img_b64}",
-            "formats": ["text", "latex_styled"],
-            "rm_spaces": True,
-            # Additional parameters to improve equation recognition
-            "math_inline_delimiters": ["$", "$"],
-            "math_display_delimiters": ["$$", "$$"],
-            # Tell MathPix this is likely math content
-            "include_asciimath": False,
-            "include_latex": True,
-        }
-
-        sys.stderr.write("[MATHPIX] Sending request to MathPix API...\n")
-        r = requests.post(
+        if DEBUG:
+            sys.stderr.write(f"[MATHPIX] Image size: {len(image_bytes)} bytes\n")
+            sys.stderr.write("[MATHPIX] Sending request to MathPix API...\n")
+
+        # Upload the raw image as multipart/form-data instead of a base64 data URL in JSON
+        is_jpeg = image_bytes[:2] == b"\xff\xd8"
+        # Credentials are sent per request since the environment may change between calls
+        r = session.post(
             "https://api.mathpix.com/v3/text",
-            json=payload,
+            files={"file": ("region.jpg", image_bytes, "image/jpeg") if is_jpeg
+                   else ("region.png", image_bytes, "image/png")},
+            data={"options_json": _MATHPIX_OPTIONS_JSON},
             headers={"app_id": app_id, "app_key": app_key},
             timeout=30,
         )
 
-        sys.stderr.write(f"[MATHPIX] Response status: {r.status_code}\n")
+        if DEBUG:
+            sys.stderr.write(f"[MATHPIX] Response status: {r.status_code}\n")
 
         if r.status_code != 200:
-            sys.stderr.write(f"[MATHPIX] Error response: {r.text}\n")
+            if DEBUG:
+                sys.stderr.write(f"[MATHPIX] Error response: {r.text}\n")
             return {"ok": False, "error": f"MathPix HTTP {r.status_code}: {r.text}"}
 
-        data = r.json()
-        sys.stderr.write(f"[MATHPIX] Full response data: {json.dumps(data, indent=2)}\n")
+        data = json_loads(r.content)
+        if DEBUG:
+            sys.stderr.write(f"[MATHPIX] Full response data: {json.dumps(data, indent=2)}\n")
 
         # MathPix returns text with embedded LaTeX using \( \) and \[ \] delimiters
         text = data.get("text", "")
@@ -133,49 +334,171 @@ def ocr_mathpix(png_bytes: bytes) -> Dict[str, Any]:
         # Use whichever LaTeX source has content
         latex = latex_from_blocks or latex_direct
 
-        sys.stderr.write(f"[MATHPIX] Extracted text: {text}\n")
-        sys.stderr.write(f"[MATHPIX] Extracted LaTeX (from blocks): {latex_from_blocks}\n")
-        sys.stderr.write(f"[MATHPIX] Extracted LaTeX (direct): {latex_direct}\n")
-        sys.stderr.write(f"[MATHPIX] Final LaTeX: {latex}\n")
-        sys.stderr.write(f"[MATHPIX] LaTeX blocks count: {len(latex_blocks)}\n")
+        if DEBUG:
+            sys.stderr.write(f"[MATHPIX] Extracted text: {text}\n")
+            sys.stderr.write(f"[MATHPIX] Extracted LaTeX (from blocks): {latex_from_blocks}\n")
+            sys.stderr.write(f"[MATHPIX] Extracted LaTeX (direct): {latex_direct}\n")
+            sys.stderr.write(f"[MATHPIX] Final LaTeX: {latex}\n")
+            sys.stderr.write(f"[MATHPIX] LaTeX blocks count: {len(latex_blocks)}\n")
 
         # If we don't have separate LaTeX but text contains LaTeX markers, use text as latex too
         if not latex and text and ('\\(' in text or '\\[' in text or '$$' in text):
             latex = text
-            sys.stderr.write("[MATHPIX] Using text field as LaTeX (contains LaTeX delimiters)\n")
+            if DEBUG:
+                sys.stderr.write("[MATHPIX] Using text field as LaTeX (contains LaTeX delimiters)\n")
 
-        return {"ok": True, "text": text, "latex": latex, "source": "ocr-mathpix"}
+        result = {"ok": True, "text": text, "latex": latex, "source": "ocr-mathpix"}
+        store_cached_ocr(image_bytes, result)
+        return result
     except Exception as e:
         sys.stderr.write(f"[MATHPIX] Exception: {str(e)}\n")
         return {"ok": False, "error": str(e)}
 
-def ocr_latexocr(png_bytes: bytes) -> Dict[str, Any]:
-    import subprocess
-    import tempfile
-    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as f:
-        f.write(png_bytes)
-        tmp = f.name
+def get_document(pdf_path: str) -> fitz.Document:
+    """
+    Return a cached document handle for pdf_path, opening it if needed.
+
+    Handles are reopened when the file's mtime changes, and the least recently
+    used handle is closed once more than MAX_OPEN_DOCUMENTS are open.
+    """
+    mtime = os.path.getmtime(pdf_path)
+    cached = _open_documents.pop(pdf_path, None)
+    if cached is not None:
+        cached_mtime, doc = cached
+        if cached_mtime == mtime:
+            _open_documents[pdf_path] = cached
+            return doc
+        doc.close()
+
+    doc = fitz.open(pdf_path)
+    _open_documents[pdf_path] = (mtime, doc)
+    while len(_open_documents) > MAX_OPEN_DOCUMENTS:
+        _, (_, evicted) = _open_documents.popitem(last=False)
+        evicted.close()
+    return doc
+
+def parse_request(args: Dict[str, Any]) -> Tuple[str, int, fitz.Rect]:
+    pdf_path = args["pdf_path"]
+    page_number = int(args["page_number"])
+    x, y = args["x"], args["y"]
+    rect = fitz.Rect(x, y, x + args["width"], y + args["height"])
+    return pdf_path, page_number, rect
+
+def read_region(doc: fitz.Document, page_number: int, rect: fitz.Rect) -> Tuple[str, Optional[bytes]]:
+    """
+    Do all document work for a region: return the normalized text layer and,
+    when it looks like math (or is empty), the rendered image to OCR.
+
+    PyMuPDF documents are not thread-safe, so this must run on the thread
+    that owns doc; the result can then be finished on any thread.
+    """
+    if page_number < 1 or page_number > len(doc):
+        raise ValueError(f"Page {page_number} out of range")
+
+    # Load the page once and share it between text extraction, the blank check and rendering
+    page = doc[page_number - 1]
+    raw = normalize_text(extract_text(page, rect))
+    if raw and not contains_math_like(raw):
+        return raw, None
+    bboxlog = None
+    if not raw:
+        bboxlog = page.get_bboxlog()
+        if region_is_blank(bboxlog, rect):
+            # Nothing drawn in the selection (e.g. a mis-click on whitespace): no need to OCR
+            return raw, None
+
+    # Try OCR only if we have the tools available
+    # Use higher scale for better quality, and add padding for better context
+    # Padding is especially important for isolated equations
+    image = render_region_image(page, rect, scale=3.0, padding=15.0, bboxlog=bboxlog)
+    return raw, image
+
+def finish_region(raw: str, image: Optional[bytes]) -> Dict[str, Any]:
+    if image is None:
+        return {"ok": True, "text": raw, "latex": "", "source": "smart" if raw else "empty"}
+
+    res = ocr_mathpix(image)
+
+    # Log MathPix result for debugging
+    if not res.get("ok"):
+        # Just use text if we have it
+        if raw:
+            return {"ok": True, "text": raw, "latex": "", "source": "text-fallback"}
+        # No text and MathPix failed
+        return {"ok": False, "error": f"MathPix failed: {res.get('error', 'Unknown error')}"}
+
+    # MathPix succeeded - return the results
+    text = normalize_text(res.get("text", ""))
+    latex = res.get("latex", "")
+    return {"ok": True, "text": text, "latex": latex, "source": res.get("source", "ocr")}
+
+def extract_region(doc: fitz.Document, page_number: int, rect: fitz.Rect) -> Dict[str, Any]:
+    return finish_region(*read_region(doc, page_number, rect))
+
+def write_result(result: Dict[str, Any]) -> None:
+    # Write encoded bytes directly, skipping a str round trip through the text layer
+    sys.stdout.flush()
+    sys.stdout.buffer.write(json_dumps(result) + b"\n")
+    sys.stdout.buffer.flush()
+
+def serve() -> None:
+    """
+    Long-running mode: read one JSON request per stdin line and answer with
+    one JSON result per stdout line. Requests may carry an "id", which is
+    echoed back so the caller can match responses.
+
+    Document work runs on the main thread; MathPix round trips run on a small
+    thread pool so network latency overlaps with the following requests.
+    Responses may therefore arrive out of order.
+    """
+    write_lock = threading.Lock()
+
+    def respond(result: Dict[str, Any], request_id: Any) -> None:
+        if request_id is not None:
+            result["id"] = request_id
+        with write_lock:
+            write_result(result)
+
+    def finish(raw: str, image: bytes, request_id: Any) -> None:
+        try:
+            result = finish_region(raw, image)
+        except Exception as e:
+            result = {"ok": False, "error": str(e)}
+        respond(result, request_id)
+
     try:
-        # Try latexocr (pix2tex CLI). Keep minimal flags.
-        proc = subprocess.run(["latexocr", tmp], capture_output=True, text=True, timeout=60)
-        if proc.returncode == 0:
-            return {"ok": True, "text": "", "latex": proc.stdout.strip(), "source": "ocr-latexocr"}
-        # Fallback to pix2tex CLI name if available
-        proc = subprocess.run(["pix2tex", tmp], capture_output=True, text=True, timeout=60)
-        if proc.returncode == 0:
-            return {"ok": True, "text": "", "latex": proc.stdout.strip(), "source": "ocr-pix2tex"}
-        return {"ok": False, "error": proc.stderr.strip() or "latexocr/pix2tex failed"}
-    except Exception as e:
-        return {"ok": False, "error": str(e)}
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_OCR) as pool:
+            # Read raw bytes: json_loads parses them directly, skipping a UTF-8 decode pass
+            for line in sys.stdin.buffer:
+                if not line.strip():
+                    continue
+                request_id = None
+                try:
+                    args = json_loads(line)
+                    request_id = args.get("id")
+                    pdf_path, page_number, rect = parse_request(args)
+                    raw, image = read_region(get_document(pdf_path), page_number, rect)
+                except Exception as e:
+                    respond({"ok": False, "error": str(e)}, request_id)
+                    continue
+                if image is None:
+                    respond(finish_region(raw, None), request_id)
+                else:
+                    # Drop the decoded images/fonts MuPDF kept from the render so
+                    # RSS stays bounded across many requests on image-heavy PDFs
+                    fitz.TOOLS.store_shrink(STORE_SHRINK_PERCENT)
+                    pool.submit(finish, raw, image, request_id)
     finally:
-        try:
-            os.unlink(tmp)
-        except Exception:
-            pass
+        while _open_documents:
+            _, (_, doc) = _open_documents.popitem()
+            doc.close()
 
 def main() -> None:
+    if sys.argv[1:] == ["--serve"]:
+        serve()
+        return
     try:
-        args = json.loads(sys.stdin.read()) if not sys.argv[1:] else {
+        args = json_loads(sys.stdin.buffer.read()) if not sys.argv[1:] else {
             "pdf_path": sys.argv[1],
             "page_number": int(sys.argv[2]),
             "x": float(sys.argv[3]),
@@ -183,40 +506,12 @@ def main() -> None:
             "width": float(sys.argv[5]),
             "height": float(sys.argv[6]),
         }
-        pdf_path = args["pdf_path"]
-        page_number = int(args["page_number"])
-        rect = fitz.Rect(args["x"], args["y"], args["x"] + args["width"], args["y"] + args["height"])
-
-        raw = normalize_text(extract_text(pdf_path, page_number, rect))
-        if raw and not contains_math_like(raw):
-            print(json.dumps({"ok": True, "text": raw, "latex": "", "source": "smart"}))
-            return
-
-        # Try OCR only if we have the tools available
-        # Use higher scale for better quality, and add padding for better context
-        # Padding is especially important for isolated equations
-        png = render_region_png(pdf_path, page_number, rect, scale=3.0, padding=15.0)
-        res = ocr_mathpix(png)
-
-        # Log MathPix result for debugging
-        if not res.get("ok"):
-            # Don't try latexocr as fallback - it's not installed
-            # Just use text if we have it
-            if raw:
-                print(json.dumps({"ok": True, "text": raw, "latex": "", "source": "text-fallback"}))
-                return
-            # No text and MathPix failed
-            print(json.dumps({"ok": False, "error": f"MathPix failed: {res.get('error', 'Unknown error')}"}))
-            return
-
-        # MathPix succeeded - return the results
-        text = normalize_text(res.get("text", ""))
-        latex = res.get("latex", "")
-        print(json.dumps({"ok": True, "text": text, "latex": latex, "source": res.get("source", "ocr")}))
+        pdf_path, page_number, rect = parse_request(args)
+        with fitz.open(pdf_path) as doc:
+            result = extract_region(doc, page_number, rect)
+        write_result(result)
     except Exception as e:
-        print(json.dumps({"ok": False, "error": str(e)}))
+        write_result({"ok": False, "error": str(e)})
 
 if __name__ == "__main__":
     main()
-
-